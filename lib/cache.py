@@ -0,0 +1,113 @@
+# encoding=UTF-8
+
+# Copyright © 2021 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+'''persistent cache of OCR results'''
+
+from __future__ import unicode_literals
+import contextlib
+import dbm
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+
+# exceptions that Cache.get() and Cache.set() can raise:
+errors = dbm.error + (EnvironmentError,)
+
+def get_default_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ocrodjvu')
+
+def get_engine_id(engine):
+    '''
+    Return identity of the OCR engine.
+
+    It includes path and modification time of the engine executable,
+    so that results are not reused after the engine is upgraded.
+    '''
+    executable = getattr(engine, 'executable', None)
+    if executable is None:
+        return engine.name,
+    path = shutil.which(executable) or executable
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    return engine.name, path, mtime
+
+def hash_file(file, *extra):
+    '''
+    Compute cache key from the file contents and the extra parameters.
+    '''
+    hash = hashlib.sha1()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(1 << 16), b''):
+        hash.update(chunk)
+    for item in extra:
+        hash.update(b'\0')
+        hash.update(str(item).encode('UTF-8'))
+    return hash.hexdigest()
+
+class Cache(object):
+
+    def __init__(self, directory):
+        try:
+            os.makedirs(directory)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        self._path = os.path.join(directory, 'ocr')
+        self._lock_path = os.path.join(directory, 'ocr.lock')
+
+    @contextlib.contextmanager
+    def _open(self):
+        # The cache can be shared between worker processes,
+        # or even between concurrent ocrodjvu invocations.
+        with open(self._lock_path, 'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                db = dbm.open(self._path, 'c')
+                try:
+                    yield db
+                finally:
+                    db.close()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # Values are stored as JSON rather than pickled,
+    # so that reading the cache cannot execute arbitrary code.
+
+    def get(self, key):
+        with self._open() as db:
+            try:
+                value = db[key]
+            except KeyError:
+                return
+        try:
+            return json.loads(value.decode('UTF-8'))
+        except ValueError:
+            # Corrupted entry; treat it as missing.
+            return
+
+    def set(self, key, value):
+        value = json.dumps(value).encode('UTF-8')
+        with self._open() as db:
+            db[key] = value
+
+__all__ = ['Cache', 'errors', 'get_default_directory', 'get_engine_id', 'hash_file']
+
+# vim:ts=4 sts=4 sw=4 et
@@ -19,21 +19,24 @@ from __future__ import unicode_literals
 from future import standard_library
 standard_library.install_aliases()
 from builtins import str
-from builtins import range
 from builtins import object
 import argparse
+import concurrent.futures.process
 import contextlib
-import inspect
-import locale
+import io
+import itertools
+import multiprocessing
 import os.path
 import shutil
+import signal
 import string
 import sys
-import threading
 import traceback
 
+from .. import cache
 from .. import cli
 from .. import engines
+from ..engines import common
 from .. import errors
 from .. import ipc
 from .. import logger
@@ -48,22 +51,17 @@ import djvu.decode
 
 __version__ = version.__version__
 
-system_encoding = locale.getpreferredencoding()
-
 logger = logger.setup()
 
 class Saver(object):
 
     in_place = False
+    needs_text = True
+    n_args = 0  # number of arguments taken by __init__()
 
     def __init__(self):
         pass
 
-    @classmethod
-    def get_n_args(cls):
-        init_args, _, _, _ = inspect.getargspec(cls.__init__)
-        return len(init_args) - 1
-
     def check(self):
         pass
 
@@ -76,6 +74,7 @@ class BundledSaver(Saver):
     '''save results as a bundled multi-page document'''
 
     options = '-o', '--save-bundled'
+    n_args = 1
 
     def __init__(self, save_path):
         self._ips = InPlaceSaver()
@@ -97,6 +96,7 @@ class IndirectSaver(Saver):
     '''save results as an indirect multi-page document'''
 
     options = '-i', '--save-indirect'
+    n_args = 1
 
     def __init__(self, save_path):
         self._ips = InPlaceSaver()
@@ -114,6 +114,7 @@ class ScriptSaver(Saver):
     '''save a djvused script with results'''
 
     options = '--save-script',
+    n_args = 1
 
     def __init__(self, save_path):
         self._save_path = os.path.abspath(save_path)
@@ -132,10 +133,12 @@ class InPlaceSaver(Saver):
         ipc.require('djvused')
 
     def save(self, document, pages, djvu_path, sed_file):
-        sed_file_name = os.path.abspath(sed_file.name)
-        djvu_path = os.path.abspath(djvu_path)
+        # The script lives in a directory created by mkdtemp(),
+        # so its path is already absolute.
+        if not os.path.isabs(djvu_path):
+            djvu_path = os.path.abspath(djvu_path)
         djvused = ipc.Subprocess(
-            ['djvused', '-s', '-f', sed_file_name, djvu_path],
+            ['djvused', '-s', '-f', sed_file.name, djvu_path],
         )
         djvused.wait()
 
@@ -144,6 +147,7 @@ class DryRunSaver(Saver):
     '''don't change any files'''
 
     options = '--dry-run',
+    needs_text = False
 
     def save(self, document, pages, djvu_path, sed_file):
         pass
@@ -245,7 +249,7 @@ class ArgumentParser(cli.ArgumentParser):
         saver_group = group.add_mutually_exclusive_group(required=True)
         for saver_type in self.savers:
             options = saver_type.options
-            n_args = saver_type.get_n_args()
+            n_args = saver_type.n_args
             metavar = [None, 'FILE'][n_args]
             saver_group.add_argument(
                 *options,
@@ -275,7 +279,7 @@ class ArgumentParser(cli.ArgumentParser):
             if n <= 0:
                 raise ValueError
             return n
-        self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=jobs, default=1, help='start N OCR threads')
+        self.add_argument('-j', '--jobs', dest='n_jobs', metavar='N', type=jobs, default=1, help='start N OCR processes')
         self.add_argument('path', metavar='FILE', help='DjVu file to process')
         group = self.add_argument_group(title='text segmentation options')
         group.add_argument('-t', '--details', dest='details', choices=('lines', 'words', 'chars'), action='store', default='words', help='amount of text details to extract')
@@ -285,6 +289,8 @@ class ArgumentParser(cli.ArgumentParser):
         group.add_argument('-X', dest='properties', metavar='KEY=VALUE', help='set an engine-specific property', action='append', default=[])
         group.add_argument('--on-error', choices=('abort', 'resume'), default='abort', help='error handling strategy')
         group.add_argument('--html5', dest='html5', action='store_true', help='use HTML5 parser')
+        group.add_argument('--cache-dir', dest='cache_dir', metavar='DIRECTORY', help='cache OCR results in this directory')
+        group.add_argument('--no-cache', dest='use_cache', action='store_false', default=True, help='''don't cache OCR results''')
 
     class list_engines(argparse.Action):
         def __call__(self, parser, namespace, values, option_string=None):
@@ -389,29 +395,63 @@ class ArgumentParser(cli.ArgumentParser):
         options.uax29 = options.language if options.word_segmentation == 'uax29' else None
         if options.n_jobs is None:
             options.n_jobs = utils.get_cpu_count()
+        options.cache = None
+        if options.use_cache:
+            cache_dir = options.cache_dir or cache.get_default_directory()
+            try:
+                options.cache = cache.Cache(cache_dir)
+            except EnvironmentError as ex:
+                _warn_cache_unusable(ex)
         return options
 
-class Results(dict):
-    seen_exception = False
+def _warn_cache_unusable(ex):
+    logger.warning('warning: cannot use the cache ({msg}); continuing without it'.format(msg=ex))
 
-    def __missing__(self, key):
-        return
+_djvused_escape_table = {
+    ord('\\'): '\\\\',
+    ord("'"): "\\'",
+}
 
 class Context(djvu.decode.Context):
 
-    def init(self, options):
-        self._temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.')
+    # Room needed for a single rendered page: roughly an A4 page at 600 dpi
+    # in 24-bpp.
+    _image_size_estimate = 128 << 20
+
+    temp_dir_in_memory = False
+
+    def init(self, options, temp_dir=None, stop_event=None):
+        if temp_dir is None:
+            parent_dir = None
+            if not options.debug:
+                # Images are written once and read once by the OCR engine,
+                # so keep them off the disk, if possible.
+                parent_dir = temporary.memory_directory(options.n_jobs * self._image_size_estimate)
+            temp_dir = temporary.raw.mkdtemp(prefix='ocrodjvu.', dir=parent_dir)
+            self.temp_dir_in_memory = parent_dir is not None
+        self._temp_dir = temp_dir
         self._debug = options.debug
         self._options = options
         bpp = 24 if self._options.render_layers != djvu.decode.RENDER_MASK_ONLY else 1
         self._image_format = self._options.engine.image_format(bpp)
-
-    def _temp_file(self, name, mode='w+', encoding=locale.getpreferredencoding(),auto_remove=True):
-        path = os.path.join(self._temp_dir, name)
-        file = open(path,mode=mode,encoding=encoding)
-        if not self._debug and auto_remove:
-            file = temporary.wrapper(file, file.name)
-        return file
+        # If raw OCR results are the only thing that is kept,
+        # don't bother extracting text from them.
+        self._text_needed = options.saver.needs_text or options.save_raw_ocr_dir is None
+        self._document = None
+        self._stop_event = stop_event
+
+    def _temp_file(self, name, mode='w+', encoding=None, auto_remove=True):
+        if self._debug or not auto_remove:
+            path = os.path.join(self._temp_dir, name)
+            return open(path, mode=mode, encoding=encoding)
+        # Some OCR engines care about the file extension,
+        # so keep it at the end of the name.
+        base, ext = os.path.splitext(name)
+        return temporary.raw.NamedTemporaryFile(
+            mode=mode, encoding=encoding,
+            prefix=base + '.', suffix=ext,
+            dir=self._temp_dir,
+        )
 
     def handle_message(self, message):
         if isinstance(message, djvu.decode.ErrorMessage):
@@ -423,7 +463,7 @@ class Context(djvu.decode.Context):
         file = self._temp_file('{n:06}.{ext}'.format(
             n=nth,
             ext=output_format.extension
-        ),mode='wb',encoding=None)
+        ), mode='w+b')
         try:
             output_format.write_image(page_job, self._options.render_layers, file)
             file.flush()
@@ -444,6 +484,49 @@ class Context(djvu.decode.Context):
         )
         result.save(prefix)
 
+    def open_document(self, path):
+        self._engine = self._options.engine
+        if self._options.cache is not None:
+            self._engine_id = cache.get_engine_id(self._engine)
+        document = self.new_document(djvu.decode.FileURI(path))
+        document.decoding_job.wait()
+        self._document = document
+        return document
+
+    def extract_text(self, page, result, size):
+        [text] = self._engine.extract_text(result.as_stringio(),
+            rotation=page.rotation,
+            details=self._options.details,
+            uax29=self._options.uax29,
+            html5=self._options.html5,
+            fix_utf8=self._engine.needs_utf8_fix,
+            page_size=size
+        )
+        # It should be: (page 0 0 <width> <height> …):
+        assert len(text) > 5
+        # Sexprs cannot be pickled, so serialize them already here.
+        file = io.StringIO()
+        text_zones.print_sexpr(text, file)
+        return file.getvalue()
+
+    def _cache_get(self, key):
+        try:
+            return self._options.cache.get(key)
+        except cache.errors as ex:
+            self._disable_cache(ex)
+
+    def _cache_set(self, key, value):
+        if self._options.cache is None:
+            return
+        try:
+            self._options.cache.set(key, value)
+        except cache.errors as ex:
+            self._disable_cache(ex)
+
+    def _disable_cache(self, ex):
+        _warn_cache_unusable(ex)
+        self._options.cache = None
+
     def process_page(self, page):
         logger.info('- Page #{0}'.format(page.n + 1))
         page_job = page.decode(wait=True)
@@ -454,94 +537,130 @@ class Context(djvu.decode.Context):
             raise page_job.status
         size = page_job.size
         with self.get_output_image(page.n, page_job) as pfile:
-            result = self._engine.recognize(pfile, language=self._options.language, details=self._options.details, uax29=self._options.uax29)
+            cache_key = None
+            cached = None
+            if self._options.cache is not None:
+                cache_key = cache.hash_file(pfile,
+                    # Text extraction may change between versions:
+                    __version__,
+                    self._engine_id,
+                    self._options.language,
+                    self._options.details,
+                    self._options.uax29,
+                    self._options.html5,
+                    page.rotation,
+                    *self._options.properties
+                )
+                cached = self._cache_get(cache_key)
+            if cached is not None:
+                output_format, contents, text = cached
+                result = common.Output(contents, format=output_format)
+            else:
+                result = self._engine.recognize(pfile, language=self._options.language, details=self._options.details, uax29=self._options.uax29)
+                if self._text_needed:
+                    text = self.extract_text(page, result, size)
+                    if cache_key is not None:
+                        self._cache_set(cache_key, [result.format, result.contents, text])
+                else:
+                    text = False  # nothing to save
             if self._debug:
                 result.save(os.path.join(self._temp_dir, '{n:06}'.format(n=page.n)))
             self.save_raw_ocr(page, result)
-            [text] = self._engine.extract_text(result.as_stringio(),
-                rotation=page.rotation,
-                details=self._options.details,
-                uax29=self._options.uax29,
-                html5=self._options.html5,
-                fix_utf8=self._engine.needs_utf8_fix,
-                page_size=size
-            )
-            # It should be: (page 0 0 <width> <height> …):
-            assert len(text) > 5
             return text
 
-    def page_thread(self, pages, results, condition):
-        for page in pages:
-            n = page.n
-            with condition:
-                result = results[n]
-                if result is not None:
-                    # The page is being processed or has been already processed.
-                    continue
-                # Mark the page as taken.
-                results[n] = True
-            try:
-                result = self.process_page(page)
-            except djvu.decode.NotAvailable:
-                logger.info('No image suitable for OCR.')
-                result = False
-            except (SystemExit, KeyboardInterrupt) as ex:
-                with condition:
-                    condition.notify()
-                raise
-            except Exception as ex:
-                try:
-                    interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
-                    message = 'Exception while processing page {n}:\n{tb}'.format(
-                        n=(n + 1),
-                        tb=traceback.format_exc()
-                    )
-                    logger.error(message.rstrip())
-                    if self._options.resume_on_error and not interrupted_by_user:
-                        # As requested by user, don't abort on error and pretend that nothing happened.
-                        results[n] = False
-                        results.seen_exception = True
-                        continue
-                    else:
-                        # The main thread will take care of aborting the application.
-                        results[n] = ex
-                        return
-                finally:
-                    with condition:
-                        condition.notify()
-            with condition:
-                assert results[n] is True
-                results[n] = result
-                condition.notify()
+    def page_worker(self, n):
+        '''
+        Process the n-th page of the open document.
+
+        Return a (n, result, failed) tuple, where result is:
+        - the djvused text for the page, or
+        - False if there's nothing to save for the page, or
+        - None if the application should be aborted.
+        '''
+        if self._stop_event is not None and self._stop_event.is_set():
+            # The application is being aborted; don't bother with this page.
+            return n, False, False
+        page = self._document.pages[n]
+        try:
+            result = self.process_page(page)
+        except djvu.decode.NotAvailable:
+            logger.info('No image suitable for OCR.')
+            return n, False, False
+        except Exception as ex:
+            interrupted_by_user = isinstance(ex, ipc.CalledProcessInterrupted) and ex.by_user
+            message = 'Exception while processing page {n}:\n{tb}'.format(
+                n=(n + 1),
+                tb=traceback.format_exc()
+            )
+            logger.error(message.rstrip())
+            if self._options.resume_on_error and not interrupted_by_user:
+                # As requested by user, don't abort on error and pretend that nothing happened.
+                return n, False, True
+            else:
+                # The main process will take care of aborting the application.
+                return n, None, True
+        return n, result, False
+
+    def _start_workers(self, njobs, path):
+        # The options (including the engine and the saver) reach the workers
+        # through fork(), not through pickle, so the fork start method is
+        # required. Also, fork before the document is opened in this
+        # process, so that no DjVuLibre decoding threads are running then.
+        mp_context = multiprocessing.get_context('fork')
+        stop_event = mp_context.Event()
+        executor = concurrent.futures.ProcessPoolExecutor(njobs,
+            mp_context=mp_context,
+            initializer=_worker_init,
+            initargs=(self._options, self._temp_dir, path, stop_event),
+        )
+        # With the fork start method, all the workers are started on the first
+        # submission.
+        executor.submit(os.getpid)
+        return executor, stop_event
 
     def _process(self, path, pages=None):
-        self._engine = self._options.engine
         logger.info('Processing {path}:'.format(path=path))
-        document = self.new_document(djvu.decode.FileURI(path))
-        document.decoding_job.wait()
+        njobs = self._options.n_jobs
+        if pages is not None:
+            njobs = min(njobs, len(pages))
+        executor = None
+        if njobs > 1:
+            executor, stop_event = self._start_workers(njobs, path)
+        try:
+            self._process_pages(path, pages, executor)
+        except KeyboardInterrupt:
+            if executor is not None:
+                # The OCR engines got SIGINT from the terminal, too,
+                # so killing the workers doesn't leave anything behind.
+                for process in multiprocessing.active_children():
+                    process.terminate()
+            raise
+        finally:
+            if executor is not None:
+                # Let the workers finish the pages they are processing, but
+                # not start new ones. Killing them would leave their OCR
+                # engine processes behind.
+                stop_event.set()
+                executor.shutdown(cancel_futures=True)
+
+    def _process_pages(self, path, pages, executor):
+        document = self.open_document(path)
         if pages is None:
             pages = list(document.pages)
         else:
             pages = [document.pages[i - 1] for i in pages]
-        results = Results()
-        njobs = self._options.n_jobs
-        thread_limit = utils.get_thread_limit(len(pages), njobs)
-        os.environ['OMP_THREAD_LIMIT'] = str(thread_limit)
-        condition = threading.Condition()
-        threads = [
-            threading.Thread(target=self.page_thread, args=(pages, results, condition))
-            for i in range(njobs)
-        ]
-        def stop_threads():
-            with condition:
-                for page in pages:
-                    # Worker threads should not bother with processing other pages.
-                    # Mark them as already taken.
-                    results[page.n] = True
-        for thread in threads:
-            thread.start()
+        thread_limit = utils.get_thread_limit(len(pages), self._options.n_jobs)
+        page_numbers = [page.n for page in pages]
+        seen_exception = False
         sed_file = self._temp_file('ocrodjvu.djvused', auto_remove=False)
         try:
+            if executor is not None:
+                # Pages are still processed concurrently,
+                # but results are delivered in page order.
+                results = executor.map(_worker_process_page, page_numbers, itertools.repeat(thread_limit))
+            else:
+                os.environ['OMP_THREAD_LIMIT'] = str(thread_limit)
+                results = map(self.page_worker, page_numbers)
             if self._options.clear_text:
                 sed_file.write('remove-txt\n')
             for page in pages:
@@ -553,50 +672,47 @@ class Context(djvu.decode.Context):
                     sed_file.write('select {n}\n'.format(n=pageno))
                 else:
                     sed_file.write("select '{fileid}'\n".format(
-                        fileid=file_id.replace('\\', '\\\\').replace("'", "\\'")
+                        fileid=file_id.translate(_djvused_escape_table)
                     ))
                 sed_file.write('set-txt\n')
-                result = None
-                with condition:
-                    while True:
-                        result = results[page.n]
-                        if result is None or result is True:
-                            # Result is not yet available.
-                            condition.wait()
-                            continue
-                        results[page.n] = Ellipsis  # no longer needed
-                        if isinstance(result, Exception):
-                            stop_threads()
-                        break
-                if isinstance(result, Exception):
-                    if len(threads) > 1:
-                        logger.info('Waiting for other threads to finish...')
-                    for thread in threads:
-                        thread.join()
+                try:
+                    n, result, failed = next(results)
+                except concurrent.futures.process.BrokenProcessPool:
+                    # The worker was killed, e.g. by a signal or by the OOM
+                    # killer, or it couldn't start at all.
+                    logger.error('A worker process died while processing page {n}.'.format(n=(page.n + 1)))
+                    n, result, failed = page.n, None, True
+                assert n == page.n
+                seen_exception |= failed
+                if result is None:
+                    if executor is not None:
+                        logger.info('Waiting for other workers to finish...')
                     self._debug = True
                     sys.exit(errors.EXIT_FATAL)
                 if result is False:
                     # No image suitable for OCR.
                     pass
                 else:
-                    text_zones.print_sexpr(result, sed_file)
+                    sed_file.write(result)
                 result = None  # no longer needed
                 sed_file.write('\n.\n\n')
             sed_file.flush()
+            if executor is not None:
+                # Make sure that workers don't hold the document open while
+                # it's being saved.
+                executor.shutdown()
             saver = self._options.saver
             if saver.in_place:
                 document = None
+                self._document = None
             pages_to_save = None
             if self._options.ocr_only:
-                pages_to_save = [page.n for page in pages]
+                pages_to_save = page_numbers
             self._options.saver.save(document, pages_to_save, path, sed_file)
             document = None
-        except:
-            stop_threads()
-            raise
         finally:
             sed_file.close()
-        if results.seen_exception:
+        if seen_exception:
             sys.exit(errors.EXIT_NONFATAL)
 
     def process(self, *args, **kwargs):
@@ -614,6 +730,22 @@ class Context(djvu.decode.Context):
         else:
             shutil.rmtree(self._temp_dir)
 
+_worker_context = None
+
+def _worker_init(options, temp_dir, path, stop_event):
+    global _worker_context
+    # Let SIGINT kill the worker (and the OCR engine) quietly;
+    # the main process takes care of reporting the interruption.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    context = Context()
+    context.init(options, temp_dir=temp_dir, stop_event=stop_event)
+    context.open_document(path)
+    _worker_context = context
+
+def _worker_process_page(n, thread_limit):
+    os.environ['OMP_THREAD_LIMIT'] = str(thread_limit)
+    return _worker_context.page_worker(n)
+
 def main(argv=sys.argv):
     options = ArgumentParser().parse_args(argv[1:])
     context = Context()
@@ -627,5 +759,7 @@ def main(argv=sys.argv):
         temp_dir = context.close()
         if temp_dir is not None:
             logger.info('Intermediate files were left in the {path!r} directory.'.format(path=temp_dir))
+            if context.temp_dir_in_memory:
+                logger.info('The directory is kept in memory; remove it when no longer needed.')
 
 # vim:ts=4 sts=4 sw=4 et
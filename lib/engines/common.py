@@ -57,13 +57,20 @@ class Output(object):
         if self.format is None:
             raise TypeError('output format is not defined')
 
+    @property
+    def contents(self):
+        return self._contents
+
     def __str__(self):
         return self._contents
 
     def save(self, prefix):
         path = '{base}.{ext}'.format(base=prefix, ext=self.format)
+        contents = self._contents
+        if isinstance(contents, str):
+            contents = contents.encode('UTF-8')
         with open(path, 'wb') as file:
-            file.write(str(self))
+            file.write(contents)
 
     def as_stringio(self):
         return io.StringIO(str(self))
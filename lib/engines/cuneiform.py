@@ -49,6 +49,7 @@ class Engine(common.Engine):
         common.Engine.__init__(self, *args, **kwargs)
         self._user_to_cuneiform = None  # to be defined later
         self._cuneiform_to_iso = None  # to be defined later
+        self._language_cache = {}
         try:
             self._languages = list(self._get_languages())
         except errors.UnknownLanguageList:
@@ -132,11 +133,16 @@ class Engine(common.Engine):
         return iter(self._languages)
 
     def user_to_cuneiform(self, language):
+        result = self._language_cache.get(language)
+        if result is not None:
+            return result
         language_set = frozenset(
             iso639.b_to_t(code, permissive=True)
             for code in language.split('+')
         )
-        return self._user_to_cuneiform.get(language_set, language)
+        result = self._user_to_cuneiform.get(language_set, language)
+        self._language_cache[language] = result
+        return result
 
     def cuneiform_to_iso(self, language):
         return self._cuneiform_to_iso.get(language, language)
@@ -135,6 +135,7 @@ class Engine(common.Engine):
             self._hocr = None
         self._user_to_tesseract = None  # to be defined later
         self._languages = list(self._get_languages())
+        self._language_cache = {}
 
     def get_filesystem_info(self):
         try:
@@ -197,15 +198,22 @@ class Engine(common.Engine):
         return isocode
 
     def user_to_tesseract(self, language):
-        result = []
+        # This is called for every page,
+        # so remember results for multi-language specifications.
+        result = self._language_cache.get(language)
+        if result is not None:
+            return result
+        codes = []
         for sublang in language.split('+'):
             isocode = self.user_to_iso639(sublang)
             try:
                 tesseract_code = self._user_to_tesseract[isocode]
             except LookupError:
                 raise errors.MissingLanguagePack(isocode)
-            result += [tesseract_code]
-        return '+'.join(result)
+            codes += [tesseract_code]
+        result = '+'.join(codes)
+        self._language_cache[language] = result
+        return result
 
     def check_language(self, language):
         self.user_to_tesseract(language)
@@ -25,6 +25,16 @@ except ImportError as ex:
     utils.enhance_import_error(ex, 'python-djvulibre', 'python-djvu', 'http://jwilk.net/software/python-djvulibre')
     raise
 
+_pbm_header = b'P4 %d %d\n'  # PBM header
+_ppm_header = b'P6 %d %d 255\n'  # PPM header
+
+_bmp_file_header = struct.Struct('<ccIHHI')
+_bmp_info_header = struct.Struct('<IIIHHIIIIII')
+_bmp_bitonal_palette = (
+    struct.pack('<BBBB', 0xFF, 0xFF, 0xFF, 0) +
+    struct.pack('<BBBB', 0, 0, 0, 0)
+)
+
 class ImageFormat(object):
 
     extension = None
@@ -74,15 +84,16 @@ class PNM(ImageFormat):
         size = page_job.size
         rect = (0, 0) + size
         if self._pixel_format.bpp == 1:
-            file.write('P4 {0} {1}\n'.format(*size).encode('ASCII'))  # PBM header
+            header = _pbm_header % size
         else:
-            file.write('P6 {0} {1} 255\n'.format(*size).encode('ASCII'))  # PPM header
+            header = _ppm_header % size
         data = page_job.render(
             render_layers,
             rect, rect,
             self._pixel_format
         )
-        file.write(data)
+        # Pixel data can be huge, so don't concatenate it with the header.
+        file.writelines((header, data))
 
 class BMP(ImageFormat):
 
@@ -112,13 +123,13 @@ class BMP(ImageFormat):
         )
         n_palette_colors = 2 * (self._pixel_format.bpp == 1)
         headers_size = 54 + 4 * n_palette_colors
-        file.write(struct.pack('<ccIHHI',
+        header = _bmp_file_header.pack(
             b'B', b'M',  # magic
             len(data) + headers_size,  # whole file size
             0, 0,  # identification magic
             headers_size  # offset to pixel data
-        ))
-        file.write(struct.pack('<IIIHHIIIIII',
+        )
+        header += _bmp_info_header.pack(
             40,  # size of this header
             size[0], size[1],  # image size in pixels
             1,  # number of color planes
@@ -128,12 +139,11 @@ class BMP(ImageFormat):
             dpm, dpm,  # resolution in pixels/meter
             n_palette_colors,  # number of colors in the color palette
             n_palette_colors  # number of important colors
-        ))
+        )
         if self._pixel_format.bpp == 1:
-            # palette:
-            file.write(struct.pack('<BBBB', 0xFF, 0xFF, 0xFF, 0))
-            file.write(struct.pack('<BBBB', 0, 0, 0, 0))
-        file.write(data)
+            header += _bmp_bitonal_palette
+        assert len(header) == headers_size
+        file.writelines((header, data))
 
 class TIFF(ImageFormat):
 
@@ -186,7 +196,6 @@ class TIFF(ImageFormat):
         assert len(header) == n_tags + 5
         header = b''.join(header)
         assert len(header) == data_offset
-        file.write(header)
-        file.write(data)
+        file.writelines((header, data))
 
 # vim:ts=4 sts=4 sw=4 et
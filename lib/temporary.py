@@ -16,12 +16,12 @@
 from __future__ import unicode_literals
 import contextlib
 import functools
+import os
 import shutil
 import tempfile as raw
 
 file = functools.partial(raw.NamedTemporaryFile, prefix='ocrodjvu.')
 name = functools.partial(raw.mktemp, prefix='ocrodjvu.')
-wrapper = raw._TemporaryFileWrapper
 
 @contextlib.contextmanager
 def directory(*args, **kwargs):
@@ -33,6 +33,26 @@ def directory(*args, **kwargs):
     finally:
         shutil.rmtree(tmpdir)
 
-__all__ = ['raw', 'file', 'directory', 'name', 'wrapper']
+def memory_directory(min_free=0):
+    '''
+    Return path to a memory-backed directory with at least min_free bytes
+    available, or None if there's no such directory.
+
+    Return None also if the user chose the temporary directory explicitly.
+    '''
+    if any(os.environ.get(var) for var in ('TMPDIR', 'TEMP', 'TMP')):
+        return
+    path = '/dev/shm'
+    try:
+        stat = os.statvfs(path)
+    except (AttributeError, EnvironmentError):
+        return
+    if not os.access(path, os.W_OK | os.X_OK):
+        return
+    if stat.f_bavail * stat.f_frsize < min_free:
+        return
+    return path
+
+__all__ = ['raw', 'file', 'directory', 'name', 'memory_directory']
 
 # vim:ts=4 sts=4 sw=4 et
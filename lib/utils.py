@@ -15,10 +15,10 @@
 
 from __future__ import unicode_literals
 from builtins import str
-from builtins import map
 from builtins import range
 from builtins import object
 import functools
+import itertools
 import locale
 import os
 import regex as re
@@ -48,14 +48,11 @@ def parse_page_numbers(pages):
     '''
     if pages is None:
         return
-    result = []
-    for page_range in pages.split(','):
-        if '-' in page_range:
-            x, y = list(map(int, page_range.split('-', 1)))
-            result += range(x, y + 1)
-        else:
-            result += [int(page_range, 10)]
-    return result
+    page_ranges = [page_range.partition('-') for page_range in pages.split(',')]
+    return list(itertools.chain.from_iterable(
+        range(int(x, 10), int(y, 10) + 1) if sep else (int(x, 10),)
+        for x, sep, y in page_ranges
+    ))
 
 _special_chars_replace = re.compile(r'''[\x00-\x1F'"\x5C\x7F-\x9F]''').sub
 
@@ -138,9 +135,11 @@ def not_overridden(f):
         return f(self, *args, **kwargs)
     return new_f
 
-def str_as_unicode(s, encoding=locale.getpreferredencoding()):
+def str_as_unicode(s, encoding=None):
     if isinstance(s, str):
         return s
+    if encoding is None:
+        encoding = locale.getpreferredencoding()
     return s.decode(encoding, 'replace')
 
 def identity(x):
@@ -165,7 +164,15 @@ class property(object):
         setattr(instance, self._private_name, self._filter(value))
         return
 
+_cpu_count = None
+
 def get_cpu_count():
+    global _cpu_count
+    if _cpu_count is None:
+        _cpu_count = _get_cpu_count()
+    return _cpu_count
+
+def _get_cpu_count():
     try:
         import multiprocessing
         return multiprocessing.cpu_count()
@@ -17,17 +17,24 @@ from __future__ import unicode_literals
 import io
 import os
 import shutil
+import signal
 import sys
 
 from lib import errors
+from lib import text_zones
 from lib import temporary
 from lib.cli import ocrodjvu
+from lib.engines import common
+from lib.engines import dummy
 
 from tests.tools import (
     assert_equal,
+    assert_in,
     assert_is_not_none,
+    assert_multi_line_equal,
     assert_not_equal,
     interim,
+    interim_environ,
     remove_logging_handlers,
     require_locale_encoding,
     try_run,
@@ -99,7 +106,8 @@ def test_nonascii_path():
         tmp_path = os.path.join(tmpdir, 'тмп.djvu')
         shutil.copy(path, tmp_path)
         with interim(sys, stdout=stdout, stderr=stderr):
-            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--in-place', tmp_path])
+            with interim_environ(XDG_CACHE_HOME=tmpdir):
+                rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--in-place', tmp_path])
     assert_equal(stderr.getvalue(), '')
     assert_equal(rc, 0)
     assert_equal(stdout.getvalue(), '')
@@ -114,10 +122,139 @@ def test_bad_page_id():
     with temporary.directory() as tmpdir:
         out_path = os.path.join(tmpdir, 'tmp.djvu')
         with interim(sys, stdout=stdout, stderr=stderr):
-            with interim(ocrodjvu, system_encoding='ASCII'):
+            with interim_environ(XDG_CACHE_HOME=tmpdir):
                 rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--save-bundled', out_path, path])
     assert_equal(stderr.getvalue(), '')
     assert_equal(rc, 0)
     assert_equal(stdout.getvalue(), '')
 
+class PageNumberEngine(dummy.Engine):
+
+    name = '_page_number'
+
+    def recognize(self, image, language, details=None, uax29=None):
+        # The image file name starts with the page number.
+        n = os.path.basename(image.name).split('.')[0]
+        return common.Output(n, format='dummy')
+
+    def extract_text(self, stream, page_size, **kwargs):
+        bbox = text_zones.BBox(0, 0, *page_size)
+        page = text_zones.Zone(text_zones.const.TEXT_ZONE_PAGE, bbox, [stream.read()])
+        return [page.sexpr]
+
+class CountingEngine(dummy.Engine):
+
+    name = '_counting'
+    n_calls = 0
+
+    def recognize(self, image, language, details=None, uax29=None):
+        type(self).n_calls += 1
+        return dummy.Engine.recognize(self, image, language, details=details, uax29=uax29)
+
+class SuicidalEngine(dummy.Engine):
+
+    name = '_suicidal'
+
+    def recognize(self, image, language, details=None, uax29=None):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+def _register_engine(engine):
+    engines = dict(ocrodjvu.ArgumentParser.engines._data)
+    engines[engine.name] = engine
+    return interim(ocrodjvu.ArgumentParser.engines, _data=engines)
+
+def _save_script(engine, path, *args):
+    remove_logging_handlers('ocrodjvu.')
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with temporary.directory() as tmpdir:
+        out_path = os.path.join(tmpdir, 'tmp.djvused')
+        with _register_engine(engine):
+            with interim(sys, stdout=stdout, stderr=stderr):
+                rc = try_run(ocrodjvu.main, ['', '--engine', engine.name] + list(args) + ['--save-script', out_path, path])
+        with open(out_path, 'rt') as file:
+            script = file.read()
+    assert_equal(stderr.getvalue(), '')
+    assert_equal(rc, 0)
+    assert_equal(stdout.getvalue(), '')
+    return script
+
+def test_jobs():
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'bad-page-id.djvu')
+    serial_script = _save_script(PageNumberEngine, path, '--no-cache', '-j', '1')
+    assert_not_equal(serial_script, '')
+    parallel_script = _save_script(PageNumberEngine, path, '--no-cache', '-j', '2')
+    assert_multi_line_equal(parallel_script, serial_script)
+
+def test_jobs_dead_worker():
+    remove_logging_handlers('ocrodjvu.')
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'bad-page-id.djvu')
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with temporary.directory() as tmpdir:
+        out_path = os.path.join(tmpdir, 'tmp.djvused')
+        with _register_engine(SuicidalEngine):
+            with interim(sys, stdout=stdout, stderr=stderr):
+                # Intermediate files are left behind after the failure;
+                # make sure they end up in tmpdir.
+                with interim_environ(TMPDIR=tmpdir):
+                    with interim(temporary.raw, tempdir=tmpdir):
+                        rc = try_run(ocrodjvu.main, ['', '--engine', SuicidalEngine.name, '--no-cache', '-j', '2', '--save-script', out_path, path])
+    assert_equal(rc, errors.EXIT_FATAL)
+    assert_in('worker process died', stderr.getvalue())
+    assert_equal(stdout.getvalue(), '')
+
+def test_cache():
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'alice.djvu')
+    with temporary.directory() as cache_dir:
+        with interim(CountingEngine, n_calls=0):
+            # Recognition runs in this process only with -j 1.
+            script = _save_script(CountingEngine, path, '--cache-dir', cache_dir, '-j', '1')
+            assert_equal(CountingEngine.n_calls, 1)
+            cached_script = _save_script(CountingEngine, path, '--cache-dir', cache_dir, '-j', '1')
+            assert_equal(CountingEngine.n_calls, 1)
+    assert_multi_line_equal(cached_script, script)
+
+def test_cache_error():
+    remove_logging_handlers('ocrodjvu.')
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'bad-page-id.djvu')
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with temporary.directory() as tmpdir:
+        out_path = os.path.join(tmpdir, 'tmp.djvused')
+        # Make the cache unusable:
+        os.mkdir(os.path.join(tmpdir, 'ocr.lock'))
+        with interim(sys, stdout=stdout, stderr=stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--cache-dir', tmpdir, '-j', '1', '--save-script', out_path, path])
+    assert_equal(rc, 0)
+    assert_equal(stderr.getvalue().count('cannot use the cache'), 1)
+    assert_equal(stdout.getvalue(), '')
+
+def test_cache_dir_error():
+    remove_logging_handlers('ocrodjvu.')
+    here = os.path.dirname(__file__)
+    here = os.path.abspath(here)
+    path = os.path.join(here, '..', 'data', 'bad-page-id.djvu')
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with temporary.directory() as tmpdir:
+        out_path = os.path.join(tmpdir, 'tmp.djvused')
+        # Make the cache directory impossible to create:
+        with open(os.path.join(tmpdir, 'file'), 'wb'):
+            pass
+        cache_dir = os.path.join(tmpdir, 'file', 'cache')
+        with interim(sys, stdout=stdout, stderr=stderr):
+            rc = try_run(ocrodjvu.main, ['', '--engine', '_dummy', '--cache-dir', cache_dir, '-j', '1', '--save-script', out_path, path])
+    assert_equal(rc, 0)
+    assert_equal(stderr.getvalue().count('cannot use the cache'), 1)
+    assert_equal(stdout.getvalue(), '')
+
 # vim:ts=4 sts=4 sw=4 et
@@ -26,6 +26,7 @@ from tests.tools import (
     assert_multi_line_equal,
     assert_equal,
     interim,
+    interim_environ,
     remove_logging_handlers,
     try_run,
     SkipTest,
@@ -45,7 +46,8 @@ def _test_ocr(engine, layers):
     with temporary.directory() as tmpdir:
         tmp_path = os.path.join(tmpdir, 'tmp.djvu')
         with interim(sys, stdout=stdout, stderr=stderr):
-            rc = try_run(ocrodjvu.main, ['', '--engine', engine, '--render', layers, '--save-bundled', tmp_path, path])
+            with interim_environ(XDG_CACHE_HOME=tmpdir):
+                rc = try_run(ocrodjvu.main, ['', '--engine', engine, '--render', layers, '--save-bundled', tmp_path, path])
     assert_multi_line_equal(stderr.getvalue(), '')
     assert_equal(rc, 0)
     assert_multi_line_equal(stdout.getvalue(), '')
@@ -0,0 +1,74 @@
+# encoding=UTF-8
+
+# Copyright © 2021 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+from __future__ import unicode_literals
+import io
+import os
+
+from tests.tools import (
+    assert_equal,
+    assert_is_none,
+    assert_not_equal,
+)
+
+from lib import temporary
+from lib.cache import (
+    Cache,
+    get_engine_id,
+    hash_file,
+)
+
+
+class test_cache(object):
+
+    def test_missing(self):
+        with temporary.directory() as tmpdir:
+            cache = Cache(os.path.join(tmpdir, 'cache'))
+            assert_is_none(cache.get('eggs'))
+
+    def test_roundtrip(self):
+        with temporary.directory() as tmpdir:
+            cache = Cache(os.path.join(tmpdir, 'cache'))
+            cache.set('eggs', ['ham', 42])
+            assert_equal(cache.get('eggs'), ['ham', 42])
+            cache = Cache(os.path.join(tmpdir, 'cache'))
+            assert_equal(cache.get('eggs'), ['ham', 42])
+
+class Engine(object):
+
+    name = 'eggs'
+
+def test_engine_id():
+    engine = Engine()
+    assert_equal(get_engine_id(engine), ('eggs',))
+    with temporary.directory() as tmpdir:
+        path = os.path.join(tmpdir, 'eggs')
+        engine.executable = path
+        assert_equal(get_engine_id(engine), ('eggs', path, None))
+        with open(path, 'wb'):
+            pass
+        os.utime(path, (0, 42))
+        assert_equal(get_engine_id(engine), ('eggs', path, 42))
+
+def test_hash_file():
+    def h(data, *extra):
+        return hash_file(io.BytesIO(data), *extra)
+    assert_equal(h(b'eggs'), h(b'eggs'))
+    assert_equal(h(b'eggs', 'eng', 2), h(b'eggs', 'eng', 2))
+    assert_not_equal(h(b'eggs'), h(b'ham'))
+    assert_not_equal(h(b'eggs', 'eng'), h(b'eggs', 'deu'))
+    assert_not_equal(h(b'eggs', 'eng', 2), h(b'eggs', 'eng', 3))
+
+# vim:ts=4 sts=4 sw=4 et
@@ -0,0 +1,29 @@
+# encoding=UTF-8
+
+# Copyright © 2021 Jakub Wilk <jwilk@jwilk.net>
+#
+# This file is part of ocrodjvu.
+#
+# ocrodjvu is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 2 as
+# published by the Free Software Foundation.
+#
+# ocrodjvu is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
+# for more details.
+
+from __future__ import unicode_literals
+
+from tests.tools import (
+    assert_is_none,
+    interim_environ,
+)
+
+from lib.temporary import memory_directory
+
+def test_memory_directory_tmpdir():
+    with interim_environ(TMPDIR='/tmp'):
+        assert_is_none(memory_directory())
+
+# vim:ts=4 sts=4 sw=4 et
@@ -145,6 +145,11 @@ class test_parse_page_numbers(object):
     def test_collapsed_range(self):
         assert_equal(parse_page_numbers('17-17'), [17])
 
+    def test_bad_syntax(self):
+        for s in '', '-17', '17-', '17-37-42', 'eggs':
+            with assert_raises(ValueError):
+                parse_page_numbers(s)
+
 class test_sanitize_utf8(object):
 
     def test_control_characters(self):